@@ -1,18 +1,17 @@
 #! /usr/bin/python3
-import time,argparse,os,sys
+import time,argparse,os,re,sys,threading,atexit
 from pathlib import Path
 import sys
 import logging
 from json import loads,load,dump,dumps
-from bs4 import BeautifulSoup
-from kwikdown import kwik_download
 from manager import process_record,load_database,print_all_records,search_record
 from execution_tracker import log_execution_time, reset_run_count, get_execution_stats
-from selenium import webdriver
-from selenium.webdriver.firefox.service import Service as chrome_service
-from selenium.webdriver.chrome.service import Service as ff_service
+from jsonio import JSON_DATA_DIR, file_version
 import concurrent.futures as concur
 
+# selenium, bs4 and kwikdown (requests/tqdm) are imported inside the functions
+# that drive the browser, so record (-r) and stats (-dt) commands start fast
+
 
 ########################################### GLOBAL VARIABLES ######################################
 
@@ -49,35 +48,53 @@ logging.basicConfig(
 #Record list
 records = []
 
+# Download menu entries to skip, only the 720p sub link is wanted
+QUALITY_SKIP_RE = re.compile(r'(360p|1080p|eng)')
+
 
 ############################################ BROWSER HANDLING ##########################################################
 
 def browser(choice="firefox"):
-    chrome_guess = ["chrome", "Chrome", "google chrome", "google"]
+    from kwikdown import start_driver
 
-    ff_guess = ["ff", "firefox", "ffgui", "ffox", "fire"]
+    # Same driver setup as the kwik downloader; the persistent profile is
+    # left to kwikdown's long-lived driver
+    driver, _ = start_driver(choice, persist=False)
 
-    if choice.lower() in chrome_guess:
-        chserv = chrome_service("/snap/bin/geckodriver")
-        
-        driver = webdriver.Chrome(service=chserv)
+    if driver is None:
+        logging.error("Unsupported browser choice")
+        return 0
 
-        logging.info("Using Chrome browser")
+    logging.info(f"Using {choice} browser in headless mode\n")
 
-    elif choice.lower() in ff_guess:
-        ffserv = ff_service("/snap/bin/geckodriver")
+    return driver
 
-        options = webdriver.FirefoxOptions()
-        options.add_argument("--headless")
-        driver = webdriver.Firefox(service=ffserv, options=options)
 
-        logging.info("Using Firefox browser in headless mode\n")
+# One browser for every page driver_output fetches in this run, so a search
+# followed by index and about pays for a single browser start
+page_driver_instance = None
+page_driver_lock = threading.Lock()
 
-    else:
-        logging.error("Unsupported browser choice")
-        return 0
 
-    return driver
+def page_driver(choice="firefox"):
+    global page_driver_instance
+
+    if not page_driver_instance:
+        page_driver_instance = browser(choice)
+
+    return page_driver_instance
+
+
+@atexit.register
+def quit_page_driver():
+    global page_driver_instance
+
+    if page_driver_instance:
+        try:
+            page_driver_instance.quit()
+        except Exception:
+            pass
+        page_driver_instance = None
 
 
 
@@ -100,34 +117,200 @@ def data_report(data:dict,filepath = "autopahe_data.json",):
             dump(new_data,st,indent=4)
 
 
-def driver_output(url:str,driver = False,content = False,json = False, wait_time = 10):
+# Resolved kwik links, so re-running a download (e.g. to resume it) skips the
+# stream page and pahe.win hops in the browser
+KWIK_LINK_CACHE = os.path.join(JSON_DATA_DIR, "kwik_links.json")
+KWIK_LINK_TTL = 30 * 60  # seconds
+kwik_link_lock = threading.Lock()
 
-    if driver == True : 
+# Parsed kwik_links.json, reused until the file changes, so every episode in a
+# multi download doesn't re-read and re-parse it. Keyed on (mtime, inode, size)
+# as saves replace the file, which a coarse mtime alone could miss
+kwik_links_memory = {"version": None, "links": {}}
 
-        driver = browser()
-        try:
-            driver.get(url)
-        except:
-            print("Selenium crashed while getting this page, please check ur internet connection")
-            driver.quit()
-            exit()
 
-        driver.refresh()
-    
-    # Wait for the page to reload
-        driver.implicitly_wait(wait_time)  # Adjust the timeout as needed
-    
-        if content:
-            # Get page source after reloading
-            page_source = driver.page_source
-            driver.quit()
-            return page_source
+def load_kwik_links():
+    # Callers hold kwik_link_lock and must not modify the returned dict
+    try:
+        version = file_version(KWIK_LINK_CACHE)
+    except FileNotFoundError:
+        return {}
+
+    if kwik_links_memory["version"] == version:
+        return kwik_links_memory["links"]
+
+    try:
+        with open(KWIK_LINK_CACHE, 'r') as json_file:
+            links = load(json_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+    kwik_links_memory["version"] = version
+    kwik_links_memory["links"] = links
+    return links
+
+
+def save_kwik_links(links):
+    # Callers hold kwik_link_lock. Write beside the file and swap it in, so
+    # readers never see half a file and every save gets a new inode
+    os.makedirs(os.path.dirname(KWIK_LINK_CACHE), exist_ok=True)
+    tmp = KWIK_LINK_CACHE + ".tmp"
+    with open(tmp, 'w') as json_file:
+        dump(links, json_file, indent=4)
+    os.replace(tmp, KWIK_LINK_CACHE)
+
+    kwik_links_memory["version"] = file_version(KWIK_LINK_CACHE)
+    kwik_links_memory["links"] = links
+
+
+def get_cached_kwik_link(key):
+    with kwik_link_lock:
+        entry = load_kwik_links().get(key)
+
+    if entry and entry['expires'] > time.time():
+        return entry['url']
+    return None
+
+
+def is_kwik_file_link(url):
+    # Only kwik's /f/ file pages can be turned into a download, anything else
+    # is a pahe.win redirect that had not finished
+    from urllib.parse import urlparse
+
+    parsed = urlparse(url or "")
+    return "kwik" in parsed.netloc and parsed.path.startswith("/f/")
+
+
+def forget_kwik_link(key):
+    with kwik_link_lock:
+        links = load_kwik_links()
+        if key not in links:
+            return
+
+        save_kwik_links({k: v for k, v in links.items() if k != key})
+
+
+def cache_kwik_link(key, url):
+    with kwik_link_lock:
+        links = load_kwik_links()
+        now = time.time()
+
+        # drop expired entries while we are rewriting the file anyway
+        links = {k: v for k, v in links.items() if v['expires'] > now}
+        links[key] = {'url': url, 'expires': now + KWIK_LINK_TTL}
+        save_kwik_links(links)
+
+
+# The API's JSON once it is in the page, null while a DDoS-Guard check is still showing
+JSON_BODY_JS = (
+    "var t = document.body ? document.body.textContent.trim() : '';"
+    "return (t[0] === '{' || t[0] === '[') ? t : null;"
+)
+
+
+API_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:131.0) Gecko/20100101 Firefox/131.0",
+    "Accept": "application/json, text/javascript, */*; q=0.01",
+    "Accept-Encoding": "gzip, deflate",
+    "X-Requested-With": "XMLHttpRequest",
+}
+
+# One pooled session for every API call in this run, so the search and
+# release lookups share a TLS connection instead of handshaking each time
+api_session_instance = None
+api_session_lock = threading.Lock()
+
+
+def api_session():
+    global api_session_instance
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    with api_session_lock:
+        if api_session_instance is None:
+            # A few quick retries only, 503 is left out because that is how
+            # DDoS-Guard answers and the browser handles it better
+            retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 504],
+                          allowed_methods=["GET"], raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+
+            session = requests.Session()
+            session.headers.update(API_HEADERS)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            api_session_instance = session
+
+    return api_session_instance
+
+
+def api_fetch(url, timeout = 15):
+    # The /api endpoints answer with plain JSON, so try them over HTTP before
+    # starting a browser. None means blocked (403, DDoS-Guard page) or failed.
+    import requests
+
+    try:
+        response = api_session().get(url, timeout=timeout)
+    except requests.RequestException as e:
+        logging.debug(f"Plain HTTP fetch of {url} failed: {e}")
+        return None
+
+    text = response.text.strip()
+    if response.status_code != 200 or text[:1] not in ("{", "["):
+        logging.debug(f"Plain HTTP fetch of {url} was refused ({response.status_code}), using the browser")
+        return None
+
+    return text
+
+
+def driver_output(url:str,driver = False,content = False,json = False, wait_time = 10, ready_css = None):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import TimeoutException
+
+    if driver == True : 
+
+        # API responses don't need a browser unless the site insists on one
+        if json == True and "/api?" in url:
+            api_response = api_fetch(url)
+            if api_response:
+                return api_response
+
+        # What the page looks like once it is usable, wait_time is only the upper bound
+        if json == True:
+            ready = lambda d: d.execute_script(JSON_BODY_JS)
+        elif ready_css:
+            ready = lambda d: d.find_elements(By.CSS_SELECTOR, ready_css)
+        else:
+            ready = lambda d: d.execute_script("return document.readyState") == "complete"
+
+        # Threads share the one browser, so only one of them drives it at a time
+        with page_driver_lock:
+            driver = page_driver()
+            try:
+                driver.get(url)
+            except:
+                print("Selenium crashed while getting this page, please check ur internet connection")
+                quit_page_driver()
+                exit()
+
+            # Reload once only if the page never got there, e.g. stuck on the DDoS-Guard check
+            try:
+                WebDriverWait(driver, wait_time).until(ready)
+            except TimeoutException:
+                driver.refresh()
+                try:
+                    WebDriverWait(driver, wait_time).until(ready)
+                except TimeoutException:
+                    pass
         
-        elif json == True:
-            # Get the json response again after reloading
-            json_data = driver.execute_script("return document.body.textContent;")
-            driver.quit()
-            return json_data
+            if content:
+                # Get page source after reloading
+                return driver.page_source
+            
+            elif json == True:
+                # Get the json response again after reloading
+                return driver.execute_script("return document.body.textContent;")
         
     else:
         logging.error("Invalid arguments for driver_output")
@@ -344,13 +527,59 @@ def index(arg):
 
 def about():
         #extract the anime info from a div with class anime-synopsis
-        ep_page = driver_output(episode_page_format,driver=True,content=True)
+        ep_page = driver_output(episode_page_format,driver=True,content=True,ready_css='.anime-synopsis')
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(ep_page,'lxml')
         abt = soup.select('.anime-synopsis')
 
         return abt[0].text.strip()
 
 
+def resolve_kwik_link(stream_page_url):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import TimeoutException, NoSuchElementException
+
+    # get steampage 
+    driver = browser()
+    try:
+        driver.get(stream_page_url)
+
+        # Let the browser's own selector engine find the download links instead
+        # of re-parsing the whole page (and then every link) with BeautifulSoup,
+        # returning as soon as the download menu has been rendered
+        try:
+            dload = WebDriverWait(driver, 30).until(
+                lambda d: d.find_elements(By.CSS_SELECTOR, 'a.dropdown-item[target="_blank"]'))
+        except TimeoutException:
+            dload = []
+
+        # keep only the 720p sub links, skipping 360p, 1080p and eng dub entries
+        linkpahe = [link.get_attribute('href') for link in dload if not QUALITY_SKIP_RE.search(link.get_attribute('outerHTML'))]
+        if not linkpahe:
+            logging.error(f"No 720p download link found on {stream_page_url}")
+            return None
+        
+        # the pahe.win page holds the redirect to the kwik download page
+        driver.get(f"{linkpahe[0]}")
+
+        #getting kwik.cx f download link, as soon as pahe.win's script points the
+        #redirect anchor at kwik rather than after a fixed delay
+        try:
+            link = WebDriverWait(driver, 15).until(
+                lambda d: d.find_element(By.CSS_SELECTOR, 'a.redirect[href*="kwik"]'))
+        except TimeoutException:
+            try:
+                link = driver.find_element(By.CSS_SELECTOR, 'a.redirect')
+            except NoSuchElementException:
+                logging.error(f"No redirect link found on {linkpahe[0]}")
+                return None
+
+        return link.get_attribute('href')
+    finally:
+        driver.quit()
+
+
 def download(arg = 1):
     # using return value of the search function to get the page
     # using the json data from the page url to get page where the episodes to watch are
@@ -367,58 +596,24 @@ def download(arg = 1):
     # print(stream_page_url)
 
     
-    # get steampage 
-    driver = browser()
-    driver.get(stream_page_url)
-
-    time.sleep(15)
-    stream_page_soup = BeautifulSoup(driver.page_source,'lxml')
-    
-    dload = stream_page_soup.find_all('a',class_='dropdown-item',target="_blank")
-    # print (dload)
-    from re import search
-
-
-    # for link in dload:
-    #     stlink = str(link)
-    #     match = re.search(r'720p', stlink)
-    #     if match:
-    #         for link in stlink:
-    #             soup = BeautifulSoup(link, 'html.parser')
-    #             href = soup.a['href']
-    #             print(href)
-    
-    # i am sure u are not wise enough to know what is going on
-    #but the code above was shortened to the code below
-    #using walrus operator and list comprehension
-    #and it return a list of chars which when combined will return the link
-
-    linkpahe = [(href:=BeautifulSoup(stlink, 'html.parser').a['href']) for link in dload if not (search(r'(360p|1080p|eng)', stlink:=str(link)))]
-    
-    #the linkpahe variable carries a list of the characters of the link
-    #so the pahewin variable will return the link webpage content
-     
-    # print(linkpahe)
-    # print(stream_page_soup)
-    driver.get(f"{linkpahe[0]}")
-    # driver.implicitly_wait(10)
-    time.sleep(10)
-    kwik_page = driver.page_source
-    driver.quit()
-
-    #getting the link to the kwik download page
-
-    kwik_cx=BeautifulSoup(kwik_page,'lxml')
-
-    # print(kwik_cx)
-
-    #getting kwik.cx f download link
-    kwik = kwik_cx.find('a', class_='redirect')['href']
+    link_key = f"{session_id}/{episode_session}"
+    kwik = get_cached_kwik_link(link_key)
+    if not is_kwik_file_link(kwik):
+        kwik = resolve_kwik_link(stream_page_url)
+        if not is_kwik_file_link(kwik):
+            print(f"Could not find a download link for episode {arg}, please try again")
+            return
+        cache_kwik_link(link_key, kwik)
 
     # print(f"Download link => {kwik}")
     Banners.downloading(animepicked,arg)
     
-    kwik_download(url=kwik, dpath=DOWNLOADS, ep=arg, animename = animepicked)
+    from kwikdown import kwik_download
+    result = kwik_download(url=kwik, dpath=DOWNLOADS, ep=arg, animename = animepicked)
+
+    # The link itself is bad (no token, POST refused), resolve it afresh next time
+    if result is False:
+        forget_kwik_link(link_key)
 
 
 
@@ -502,6 +697,37 @@ def interactive_main():
     else:
         print("Invalid input. Please select a valid option.")
 
+# ----------------------------------------------- Record handling -----------------------------------------------------
+
+def show_record(position):
+    position = int(position)
+    database = load_database()
+
+    if str(position) in database:
+        print(dumps(database[str(position)], indent=4))
+    else:
+        logging.info(f"No record found at position {position}")
+
+
+def find_records(keyword):
+    results = search_record(keyword)
+    if results:
+        print(dumps(results, indent=4))
+    else:
+        print("No matching records found.")
+
+
+# Named record commands, anything else is an index or a search keyword
+RECORD_COMMANDS = {
+    "view": lambda rarg: print_all_records(),
+}
+
+
+def record_command(rarg):
+    handler = RECORD_COMMANDS.get(rarg) or (show_record if rarg.isdigit() else find_records)
+    handler(rarg)
+
+
 def command_main(args):
     global barg
     barg = args.browser
@@ -516,9 +742,9 @@ def command_main(args):
     # Reset the run count
     reset_run_count()
 
-    # Init browser
+    # Init browser, later page fetches reuse it
     if barg:
-        browser(barg)
+        page_driver(barg)
 
     # Search function
     if sarg:
@@ -553,23 +779,7 @@ def command_main(args):
 
     # Record argument
     if rarg:
-        if rarg == "view":
-            print_all_records()
-
-        elif rarg.isdigit():
-            position = int(rarg)
-            database = load_database()
-            
-            if str(position) in database:
-                print(dumps(database[str(position)], indent=4))
-            else:
-                logging.info(f"No record found at position {position}")
-        else:
-            results = search_record(rarg)
-            if results:
-                print(dumps(results, indent=4))
-            else:
-                print("No matching records found.")
+        record_command(rarg)
 
     # Date argument to retrieve execution stats
     if dtarg:
@@ -1,20 +1,15 @@
 # execution_tracker.py
-import json
 import os
 import time
 from datetime import datetime, timedelta
 
+from jsonio import JSON_DATA_DIR, dumps, loads
+
 # Initialize counters and timings
-cwd = os.path.dirname(os.path.abspath(__file__))
-# print(os.path.expandvars(cwd))
 script_run_count = 0
 first_run_time = datetime.now()
 
-if not os.path.exists("json_data"):
-    os.mkdir(os.path.join(cwd, "json_data"))
-    
-
-DATA_FILE = os.path.join(cwd, "json_data/execution_data.py")
+DATA_FILE = os.path.join(JSON_DATA_DIR, "execution_data.py")
 
 
 # Function to log the execution time and run count
@@ -76,8 +71,9 @@ def load_execution_data():
         dict: A dictionary containing execution data. If the file doesn't exist, returns an empty dictionary.
     """
     if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as file:
-            return json.load(file)
+        with open(DATA_FILE, 'rb') as file:
+            raw = file.read()
+        return loads(raw)
     return {}
 
 # Save execution data to a file
@@ -88,8 +84,10 @@ def save_execution_data(data):
     Args:
         data (dict): A dictionary containing the execution data to be saved.
     """
-    with open(DATA_FILE, 'w') as file:
-        json.dump(data, file, indent=4)
+    payload = dumps(data)
+
+    with open(DATA_FILE, 'wb') as file:
+        file.write(payload)
 
 # Function to reset the run count at midnight
 def reset_run_count():
@@ -139,13 +137,12 @@ def get_execution_stats(date_input):
     # Ensure execution_data.json exists; create it if not
     file_path = DATA_FILE
     if not os.path.exists(file_path):
-        with open(file_path, 'w') as f:
-            json.dump({}, f)
+        with open(file_path, 'wb') as f:
+            f.write(b'{}')
 
     # Load execution data from JSON file
     try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
+        data = load_execution_data()
     except Exception as e:
         print(f"Error retrieving execution stats: {e}")
         return None
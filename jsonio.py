@@ -0,0 +1,37 @@
+# jsonio.py
+import json
+import os
+
+# orjson is optional, it parses and serialises much faster than json when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Resolve json_data next to this file, not in whatever directory we were run from
+JSON_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "json_data")
+os.makedirs(JSON_DATA_DIR, exist_ok=True)
+
+
+def loads(raw):
+    """
+    Parse JSON from bytes or str, with orjson when it is installed.
+    """
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+def dumps(data):
+    """
+    Serialise data to pretty-printed JSON bytes, with orjson when it is installed.
+    """
+    if orjson:
+        # json turns non-string keys into strings, have orjson do the same
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, indent=4).encode('utf-8')
+
+def file_version(path):
+    """
+    (mtime, inode, size) of path. Files saved by replacing them get a new inode,
+    so this changes on every save even when a coarse mtime does not.
+    """
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_ino, st.st_size
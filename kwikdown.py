@@ -1,160 +1,883 @@
 #!/usr/bin/env python
 
 
-import requests,os,tqdm,time
+import requests,os,re,json,socket,tqdm,time,threading,atexit,inspect
+from pathlib import Path
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from requests.cookies import create_cookie
+from urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
 from selenium import webdriver
-from selenium.webdriver.firefox.service import Service as chrome_service
-from selenium.webdriver.chrome.service import Service as ff_service
-from bs4 import BeautifulSoup
+from selenium.webdriver.firefox.service import Service as ff_service
+from selenium.webdriver.chrome.service import Service as chrome_service
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException, WebDriverException
 
-    
 
+# The CSRF token kwik embeds in the download form
+_TOKEN_RE = re.compile(r'name="_token"\s+value="([^"]+)"')
 
-def kwik_download(url:str,browser: str = "firefox",dpath:str = os.getcwd(),chunk_size: int = 10 * 1024,ep=None,animename = None):
-    # changing to specified path
-    os.chdir(dpath)
+# The filename in a Content-Disposition header, quoted or not
+_FILENAME_RE = re.compile(r'filename="?([^";]+)"?', re.IGNORECASE)
 
-    #Generating post url from url 
-    posturl = url.replace("/f/","/d/")
-    
-    # browser handling
-    chrome_guess = ["chrome","Chrome","google chrome","google"]
-    ff_guess = ["ff","firefox","ffgui","ffox","fire"]
+# 'Content-Range: bytes <start>-<end>/<total or *>'
+_CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)', re.IGNORECASE)
+
+# True once the countdown script has filled in the form's hidden token
+_TOKEN_READY_JS = (
+    "var i = document.querySelector('form input[type=hidden]');"
+    "return !!(i && i.value && i.value.length > 10);"
+)
+
+_TOKEN_VALUE_JS = (
+    "var i = document.querySelector('form input[type=hidden]');"
+    "return i ? i.value : null;"
+)
+
+# Static headers for the download POST, matching the browser that fetched
+# the token and cookies. Read-only, as they are shared by every download;
+# Origin and Referer are filled in per episode from the kwik URL, and Host is
+# left to requests so it stays right for kwik.si, kwik.cx and CDN redirects.
+# The video is already compressed, so ask for the raw bytes; this also
+# keeps Range offsets aligned with the file on disk
+_FIREFOX_HEADERS = MappingProxyType({
+    'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:129.0) Gecko/20100101 Firefox/129.0',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/png,image/svg+xml,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'identity',
+    'Content-Type': 'application/x-www-form-urlencoded',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'same-origin',
+    'Sec-Fetch-User': '?1',
+    'Priority': 'u=0, i',
+    'TE': 'trailers'
+})
+
+_CHROME_HEADERS = MappingProxyType({
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'identity',
+    'Content-Type': 'application/x-www-form-urlencoded',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Ch-Ua': '"Google Chrome";v="129", "Not=A?Brand";v="8", "Chromium";v="129"',
+    'Sec-Ch-Ua-Mobile': '?0',
+    'Sec-Ch-Ua-Platform': '"Linux"',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'same-origin',
+    'Sec-Fetch-User': '?1',
+    'Priority': 'u=0, i'
+})
+
+# Bytes written between progress bar refreshes
+_PROGRESS_STEP = 1 << 20
+
+# Episodes at least this big are fetched as parallel byte ranges
+_RANGE_WORKERS = 4
+_MIN_PARALLEL_SIZE = 16 << 20
+
+# One pooled session shared by every episode so kwik connections (and their
+# TLS handshakes) are reused instead of being rebuilt per download
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose sockets use TCP keepalive, so a stalled connection
+    during a long download is detected instead of hanging until the read
+    timeout on every retry.
+    """
+
+    socket_options = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+    # TCP_KEEPIDLE/TCP_KEEPINTVL are missing on some platforms (e.g. macOS)
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30))
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10))
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def setup_session(retries=5):
+    """
+    Build a requests session with a connection pool and retries on
+    transient server errors.
+    """
+    session = requests.Session()
+
+    retry_options = dict(
+        total=retries,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["HEAD", "GET", "POST"],
+        # hand the final response back rather than raising, so callers see the status
+        raise_on_status=False,
+    )
+    # urllib3 1.x has no backoff_max argument (its cap is a fixed 120s)
+    if "backoff_max" in inspect.signature(Retry.__init__).parameters:
+        retry_options["backoff_max"] = 30
+    retry = Retry(**retry_options)
+
+    # Only kwik is downloaded from, so a couple of host pools is plenty. Each
+    # episode holds up to _RANGE_WORKERS connections and multi_download runs
+    # several episodes side by side, so keep enough per host that returned
+    # connections are pooled rather than discarded
+    adapter = KeepAliveAdapter(pool_connections=2, pool_maxsize=32, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def _get_session():
+    global _SESSION
+
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = setup_session()
+
+    return _SESSION
+
+
+def _profile_dir(browser_name):
+    # Browser profile kept between runs so kwik/DDoS-Guard cookies survive
+    path = Path.home() / ".cache" / "autopahe-selenium" / browser_name
+    path.mkdir(parents=True, exist_ok=True)
+    return str(path)
+
+
+# Lowercased spellings accepted for each supported browser
+_CHROME_NAMES = frozenset({"chrome", "google chrome", "google"})
+_FIREFOX_NAMES = frozenset({"ff", "firefox", "ffgui", "ffox", "fire"})
+
+
+def _browser_kind(browser):
+    # Map the user's browser choice onto "chrome", "firefox" or None
+    browser = browser.lower()
+    if browser in _CHROME_NAMES:
+        return "chrome"
+    elif browser in _FIREFOX_NAMES:
+        return "firefox"
+    return None
+
+
+def start_driver(browser, persist=True):
+    """
+    Launch a headless Selenium driver for the chosen browser.
+
+    With `persist` the driver uses a profile directory that outlives the
+    process, falling back to a throwaway profile if that one is in use.
+
+    Returns the driver and the download headers matching that browser,
+    or (None, None) if the browser is not supported.
+    """
+    kind = _browser_kind(browser)
     
-    if browser.lower() in chrome_guess:
-        chserv = chrome_service("/snap/bin/geckodriver")
+    if kind == "chrome":
+        # let Selenium Manager locate chromedriver
+        chserv = chrome_service()
         
         options = webdriver.ChromeOptions()
-        options.headless = True
+        options.add_argument("--headless=new")
+        # Only the form and its script matter, skip images/styles and don't
+        # wait for subresources before driver.get() returns
+        options.page_load_strategy = "eager"
+        options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.managed_default_content_settings.stylesheets": 2,
+            "profile.managed_default_content_settings.fonts": 2,
+        })
+
+        if persist:
+            options.add_argument(f"--user-data-dir={_profile_dir('chrome')}")
+            try:
+                return webdriver.Chrome(service = chserv,options=options), _CHROME_HEADERS
+            except WebDriverException:
+                # the profile is locked by another running driver
+                return start_driver(browser, persist=False)
         
-        driver = webdriver.Chrome(service = chserv,options=options)
+        return webdriver.Chrome(service = chserv,options=options), _CHROME_HEADERS
         
-    elif browser.lower() in ff_guess:
+    elif kind == "firefox":
         ffserv = ff_service("/snap/bin/geckodriver")
         
         options = webdriver.FirefoxOptions()
         options.add_argument("-headless")
+        # Only the form and its script matter, skip images/styles/fonts/media
+        # and don't wait for subresources before driver.get() returns
+        options.page_load_strategy = "eager"
+        options.set_preference("permissions.default.image", 2)
+        options.set_preference("permissions.default.stylesheet", 2)
+        options.set_preference("browser.display.use_document_fonts", 0)
+        options.set_preference("media.autoplay.default", 5)
+
+        if persist:
+            options.add_argument("-profile")
+            options.add_argument(_profile_dir("firefox"))
+            try:
+                return webdriver.Firefox(service=ffserv,options=options), _FIREFOX_HEADERS
+            except WebDriverException:
+                # the profile is locked by another running driver
+                return start_driver(browser, persist=False)
         
-        driver = webdriver.Firefox(service=ffserv,options=options)
-    else:
-        print(f"Sorry your browser is not supported :( ,\nfeel free to report the issue at https://github.com/haxsysgit/autopahe/issues")
-        return 0
-    
+        return webdriver.Firefox(service=ffserv,options=options), _FIREFOX_HEADERS
+
+    return None, None
+
+
+# One browser per kind, kept open for every episode of the run instead of
+# being launched and torn down per download
+_DRIVERS = {}
+_DRIVER_LOCK = threading.Lock()
+
+
+def _get_shared_driver(browser):
+    """
+    Return the shared (driver, headers) pair for the browser, starting it on
+    first use. Callers must hold _DRIVER_LOCK while using the driver.
+    """
+    kind = _browser_kind(browser)
+    if kind is None:
+        return None, None
+
+    if kind not in _DRIVERS:
+        _DRIVERS[kind] = start_driver(browser)
+
+    return _DRIVERS[kind]
+
+
+def _discard_shared_driver(browser):
+    driver, _ = _DRIVERS.pop(_browser_kind(browser), (None, None))
+    if driver is not None:
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+
+@atexit.register
+def _quit_shared_drivers():
+    for driver, _ in list(_DRIVERS.values()):
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+    _DRIVERS.clear()
+
+
+def _acquire_token_cookies(driver, url, posturl):
+    """
+    Load the kwik page in the driver and collect the form's CSRF token and
+    the cookies issued for the download endpoint.
+
+    Returns (token, cookies) with the cookies as Selenium dicts, or
+    (None, None) if no token was found.
+    """
     driver.get(url)
+
+    # Return as soon as the token is populated instead of reading the page
+    # before the countdown has run
+    try:
+        WebDriverWait(driver, 10).until(lambda d: d.execute_script(_TOKEN_READY_JS))
+    except TimeoutException:
+        time.sleep(1)
     
-    # Extract the page source
-    page_source = driver.page_source
-    
-    # Create a BeautifulSoup object from the page source
-    soup = BeautifulSoup(page_source, "lxml")
-    
-    # Find the form element
-    form = soup.find("form")
-    
-    # Find the hidden input element within the form and Extract the value attribute of the hidden input
-    token = form.find("input", attrs={"type": "hidden"})['value']
-    # print(f"\n{token}")
+    # Let the browser read the token from its own DOM, and only fall back to
+    # a regex scan of the serialised page source if that comes back empty
+    token = driver.execute_script(_TOKEN_VALUE_JS)
+    if not token:
+        match = _TOKEN_RE.search(driver.page_source)
+        if not match:
+            return None, None
+        token = match.group(1)
+
     # Navigate to the desired page
     driver.get(posturl)
 
-    # Get the cookies
-    cookies = driver.get_cookies()
-    # print(f"\n\n{cookies}")
-    # Combine cookies into a single string
-    cookie_string = ';'.join([cookie['name'] + '=' + cookie['value'] for cookie in cookies])
-    # print(f"\n\n{cookie_string}")
+    now = time.time()
 
-    # Quit the driver
-    driver.quit()
-    
-    # request handlin
-    params = {"_token":token}
-    preheaders = {
-        'Host': 'kwik.si',
-        'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:129.0) Gecko/20100101 Firefox/129.0',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/png,image/svg+xml,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip, deflate, br, zstd',
-        'Referer': url,
-        'Content-Type': 'application/x-www-form-urlencoded',
-        'Content-Length': '47',
-        'Origin': 'https://kwik.si',
-        'Connection': 'keep-alive',
-        'Cookie': cookie_string,
-        'Upgrade-Insecure-Requests': '1',
-        'Sec-Fetch-Dest': 'document',
-        'Sec-Fetch-Mode': 'navigate',
-        'Sec-Fetch-Site': 'same-origin',
-        'Sec-Fetch-User': '?1',
-        'Priority': 'u=0, i',
-        'TE': 'trailers'
-    }
+    # expired cookies would only be rejected by the server
+    cookies = [cookie for cookie in driver.get_cookies()
+               if cookie.get('expiry') is None or cookie['expiry'] >= now]
+
+    return token, cookies
+
+
+def _cookie_jar(cookies):
+    # Keep the cookies in a jar of their own and send them per request, so
+    # concurrent episodes sharing the session never swap each other's cookies
+    cookie_jar = requests.cookies.RequestsCookieJar()
+    for cookie in cookies:
+        cookie_jar.set_cookie(create_cookie(
+            name=cookie['name'],
+            value=cookie['value'],
+            domain=cookie.get('domain') or 'kwik.si',
+            path=cookie.get('path', '/'),
+            secure=cookie.get('secure', False),
+        ))
+
+    return cookie_jar
+
+
+# kwik's token belongs to its session cookies rather than to one file, so a
+# (token, cookies) pair fetched by the browser is reused for later episodes
+# on the same host, within this run and across runs
+_TOKEN_CACHE_FILE = Path.home() / ".cache" / "autopahe" / "kwik_token.json"
+_TOKEN_TTL = 10 * 60  # seconds
+_TOKEN_CACHE = None
+_TOKEN_LOCK = threading.Lock()
+
+
+def _token_cache():
+    global _TOKEN_CACHE
+
+    if _TOKEN_CACHE is None:
+        try:
+            with open(_TOKEN_CACHE_FILE, 'r') as f:
+                _TOKEN_CACHE = json.load(f)
+        except (FileNotFoundError, ValueError):
+            _TOKEN_CACHE = {}
+
+    return _TOKEN_CACHE
+
+
+def _save_token_cache():
+    # The file holds live session cookies and the CSRF token, so keep it
+    # private to the user and swap it in whole rather than rewrite it in place
+    _TOKEN_CACHE_FILE.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    payload = json.dumps(_TOKEN_CACHE).encode('utf-8')
+
+    tmp = f"{_TOKEN_CACHE_FILE}.tmp"
+    try:
+        os.remove(tmp)  # a leftover would keep its old permissions
+    except FileNotFoundError:
+        pass
+
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, _TOKEN_CACHE_FILE)
+
+
+def _cached_token(host, kind):
+    with _TOKEN_LOCK:
+        entry = _token_cache().get(host)
+
+    # the cookies are tied to the browser's User-Agent, so only reuse them
+    # with the same kind of browser headers
+    if entry and entry['browser'] == kind and entry['exp'] > time.time():
+        return entry
+    return None
+
+
+def _store_token(host, entry):
+    with _TOKEN_LOCK:
+        _token_cache()[host] = entry
+        _save_token_cache()
+
+
+def _forget_token(host):
+    with _TOKEN_LOCK:
+        if _token_cache().pop(host, None) is not None:
+            _save_token_cache()
 
+
+# Hosts that rejected the environment token, it is not offered to them again this run
+_REJECTED_ENV_HOSTS = set()
+
+
+def _env_token(host):
+    """
+    Token and cookies handed in by an outer script through
+    AUTOPAHE_KWIK_TOKEN and AUTOPAHE_KWIK_COOKIES, which lets batch jobs skip
+    the browser entirely. The cookies are JSON, either {name: value} or the
+    list of cookie dicts stored in kwik_token.json.
+    """
+    token = os.environ.get("AUTOPAHE_KWIK_TOKEN")
+    if not token or host in _REJECTED_ENV_HOSTS:
+        return None
+
+    try:
+        cookies = json.loads(os.environ.get("AUTOPAHE_KWIK_COOKIES") or "{}")
+    except ValueError:
+        print("AUTOPAHE_KWIK_COOKIES is not valid JSON, ignoring it")
+        cookies = {}
+
+    if isinstance(cookies, dict):
+        cookies = [{'name': name, 'value': value, 'domain': host} for name, value in cookies.items()]
+
+    return {'token': token, 'cookies': cookies}
+
+
+def _browser_token(url, posturl, browser):
+    """
+    Fetch a fresh token and cookies with the shared browser.
+
+    Returns a token cache entry, or None if the page had no token.
+    """
+    # The driver is shared, so episodes running on other threads take turns
+    with _DRIVER_LOCK:
+        driver, _ = _get_shared_driver(browser)
+
+        try:
+            token, cookies = _acquire_token_cookies(driver, url, posturl)
+        except WebDriverException:
+            # the browser died or hung, start a fresh one and try once more
+            _discard_shared_driver(browser)
+            driver, _ = _get_shared_driver(browser)
+            token, cookies = _acquire_token_cookies(driver, url, posturl)
+
+    if token is None:
+        return None
+
+    return {'token': token, 'cookies': cookies, 'browser': _browser_kind(browser),
+            'exp': time.time() + _TOKEN_TTL}
+
+
+def _build_headers(url, base_headers):
+    parsed = urlparse(url)
+    headers = dict(base_headers)
+    headers['Origin'] = f"{parsed.scheme}://{parsed.netloc}"
+    headers['Referer'] = url
+    return headers
+
+
+def kwik_download(url:str,browser: str = "firefox",dpath:str = os.getcwd(),chunk_size: int = 10 * 1024,ep=None,animename = None):
+    """
+    Download the episode behind a kwik /f/ link into dpath.
+
+    Returns the file's path once it is complete, False if nothing could be
+    fetched (unsupported browser, no token on the kwik page, or the
+    download POST was refused), and None if the download stopped partway
+    and can be resumed.
+    """
+    #Generating post url from url 
+    posturl = url.replace("/f/","/d/")
     
+    kind = _browser_kind(browser)
+    if kind is None:
+        print(f"Sorry your browser is not supported :( ,\nfeel free to report the issue at https://github.com/haxsysgit/autopahe/issues")
+        return False
 
-    response = requests.post(posturl,data=params,headers=preheaders,stream=True)
+    base_headers = _CHROME_HEADERS if kind == "chrome" else _FIREFOX_HEADERS
+    download_headers = _build_headers(url, base_headers)
+    session = _get_session()
+    host = urlparse(url).netloc
 
-    total_size = int(response.headers.get('content-length', 0))
-    filename = None
+    # Probe once to learn the filename, total size and Range support cheaply,
+    # trying a supplied token and then the cached one so the browser is skipped
+    token_entry = None
+    for source in ("env", "cache"):
+        token_entry = _env_token(host) if source == "env" else _cached_token(host, kind)
+        if token_entry is None:
+            continue
 
-    # Extract the filename from the content disposition header
-    content_disposition = response.headers.get("content-disposition")
-    if content_disposition:
-        filename_start = content_disposition.find("filename=")
-        if filename_start != -1:
-            filename = content_disposition[filename_start + 9:]
+        params = {"_token": token_entry['token']}
+        cookie_jar = _cookie_jar(token_entry['cookies'])
+        probe = probe_download(session, posturl, params, download_headers, cookie_jar)
+
+        # 403/419 means the token or its session has expired; only drop the
+        # one that was actually rejected
+        if probe[0] not in (403, 419):
+            break
+        if source == "env":
+            _REJECTED_ENV_HOSTS.add(host)
+        else:
+            _forget_token(host)
+        token_entry = None
+
+    if token_entry is None:
+        token_entry = _browser_token(url, posturl, browser)
+        if token_entry is None:
+            print("Could not find the download token on the kwik page, please try again")
+            return False
+        _store_token(host, token_entry)
+
+        # request handlin
+        params = {"_token": token_entry['token']}
+        cookie_jar = _cookie_jar(token_entry['cookies'])
+        probe = probe_download(session, posturl, params, download_headers, cookie_jar)
 
+    status, filename, total_size, accepts_ranges = probe
+
+    if status is None:
+        return False
+
+    if status not in (200, 206):
+        print("Failed to download the MP4 file.\n")
+        print(f"return code : {status}")
+        return False
 
     # If the filename is not extracted, use a default name
-    # changing to path is specified, if not the current path
     if not filename:
         filename = "video.mp4"  # Use a default filename if not extracted from headers
 
-    # Check if the file already exists
+    # Absolute path rather than os.chdir, which is process-wide and would race
+    # between episodes downloading on different threads
+    filename = os.path.join(dpath, filename)
+
+    # Stream into a .part file so an interrupted download never looks like a
+    # finished episode; it only takes the real name once it is complete
+    part_filename = filename + ".part"
+
     if os.path.exists(filename):
-        file_size = os.path.getsize(filename)
-        kwikhead = {**preheaders,"Range":f"bytes={file_size}-"}
-    
+        if total_size and os.path.getsize(filename) == total_size:
+            print(f"Episode {ep} is already downloaded : {filename}")
+            return filename
+        # an incomplete file left under the final name, resume it as a .part
+        os.replace(filename, part_filename)
 
-    
-    response = requests.post(posturl,data=params,headers=preheaders,stream=True)
+    downloaded = None
+    ranges_filename = filename + ".ranges.part"
 
-    total_size = int(response.headers.get('content-length', 0))
+    # Fresh downloads of a decent size are split into parallel ranges, and an
+    # interrupted parallel download carries on from its saved ranges; partial
+    # .part files are resumed by the single stream below
+    if accepts_ranges and total_size and hasattr(os, "pwrite") and (
+            os.path.exists(ranges_filename)
+            or (total_size >= _MIN_PARALLEL_SIZE and not os.path.exists(part_filename))):
+        downloaded = download_ranges(session, posturl, params, download_headers, cookie_jar,
+                                     ranges_filename, total_size, ep=ep, chunk_size=chunk_size)
+        if downloaded is None:
+            print(f"Episode {ep} did not finish downloading, run the command again to resume it.")
+            return None
+        elif downloaded is False:
+            # the preallocated file has holes, it cannot be resumed as a .part
+            for leftover in (ranges_filename, ranges_filename + ".json"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            print(f"Parallel download of episode {ep} failed, retrying as a single stream.")
+            downloaded = None
+        else:
+            part_filename = ranges_filename
 
-    
-    if response.status_code == 200:
-        # Save the content to a file
+    if downloaded is None:
+        downloaded = download_with_retries(session, posturl, params, download_headers, cookie_jar, part_filename,
+                                           total_size, accepts_ranges, ep=ep, chunk_size=chunk_size)
+
+    if downloaded is None or (total_size and downloaded != total_size):
+        print(f"Episode {ep} did not finish downloading, run the command again to resume it.")
+        return None
+
+    os.replace(part_filename, filename)
+    return filename
+
+
+def probe_download(session, posturl, params, headers, cookies=None):
+    """
+    Request a single byte of the file so the server reports the filename,
+    the total size (via Content-Range) and whether it honours Range requests,
+    without streaming the whole body.
+
+    The status is None if the server could not be reached at all.
+    """
+    try:
+        probe = session.post(posturl, data=params, headers={**headers, "Range": "bytes=0-0"},
+                             cookies=cookies, stream=True, timeout=15)
+    except requests.RequestException as e:
+        print(f"Could not reach the download server : {e}")
+        return None, None, 0, False
+    probe.close()
+
+    filename = None
 
-        with open(filename, "wb") as file,tqdm.tqdm(
+    # Extract the filename from the content disposition header
+    match = _FILENAME_RE.search(probe.headers.get("content-disposition", ""))
+    if match:
+        # Never let the server pick a path outside the download directory
+        filename = os.path.basename(match.group(1).strip()) or None
+
+    # 'Content-Range: bytes 0-0/<total>' carries the full size even when the
+    # server strips Content-Length on 206 responses
+    total_size = 0
+    content_range = _CONTENT_RANGE_RE.search(probe.headers.get("content-range", ""))
+    if content_range and content_range.group(3) != "*":
+        total_size = int(content_range.group(3))
+    elif probe.status_code == 200:
+        total_size = int(probe.headers.get("content-length", 0))
+
+    # A 206 answering our byte range is proof enough; nginx and many CDNs
+    # only send Accept-Ranges on 200 responses, so it is just a bonus signal
+    accepts_ranges = probe.status_code == 206 and (
+        (content_range is not None and content_range.group(1) == "0")
+        or probe.headers.get("Accept-Ranges") == "bytes")
+
+    return probe.status_code, filename, total_size, accepts_ranges
+
+
+def download_with_retries(session, posturl, params, headers, cookies, filename, total_size,
+                          accepts_ranges, ep=None, chunk_size=10 * 1024, retries=3):
+    """
+    Stream the file to `filename`, resuming from the partial file when the
+    server supports Range requests and restarting from zero otherwise.
+
+    Returns the size of the file on disk, or None if the download failed.
+    """
+    for attempt in range(1, retries + 1):
+        try:
+            file_size = os.stat(filename).st_size
+        except FileNotFoundError:
+            file_size = 0
+
+        # Nothing left to fetch
+        if total_size and file_size == total_size:
+            return file_size
+
+        # Bigger than the file the server has now, e.g. it was replaced
+        # since the partial was written; the partial is useless
+        if total_size and file_size > total_size:
+            print(f"Partial file for episode {ep} is larger than the episode, restarting it.")
+            file_size = 0
+
+        # Only send a Range the server has told us it will honour,
+        # otherwise truncate the partial file and start again
+        if file_size and accepts_ranges:
+            kwikhead = {**headers, "Range": f"bytes={file_size}-"}
+        else:
+            file_size = 0
+            kwikhead = headers
+
+        try:
+            response = session.post(posturl, data=params, headers=kwikhead, cookies=cookies,
+                                    stream=True, timeout=30)
+        except requests.RequestException as e:
+            print(f"Attempt {attempt}/{retries} failed : {e}")
+            continue
+
+        # For Downloading partial content i.e 206 is partial content
+        if response.status_code == 206:
+            # Only append when the server resumed exactly where the partial ends
+            content_range = _CONTENT_RANGE_RE.search(response.headers.get("content-range", ""))
+            if content_range is None or int(content_range.group(1)) != file_size:
+                print(f"Server resumed episode {ep} at the wrong offset, restarting it.")
+                response.close()
+                os.truncate(filename, 0)
+                continue
+            mode = "ab"
+        elif response.status_code == 200:
+            mode = "wb"
+            file_size = 0
+        else:
+            print("Failed to download the MP4 file.\n")
+            print(f"return code : {response.status_code}")
+            response.close()
+            return None
+
+        # Unbuffered: chunks are already large, so Python's write buffer would
+        # only add a copy before each write reaches the kernel
+        with open(filename, mode, buffering=0) as file, tqdm.tqdm(
             desc=f'Downloading Episode {ep}',
-            total=total_size,
+            total=total_size or None,
+            initial=file_size,
             unit='B',
             unit_scale=True,
             unit_divisor=1024,
             ncols=80
         ) as progress_bar:
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                file.write(chunk)
-                progress_bar.update(len(chunk))
+            # Report progress in batches rather than once per chunk to keep
+            # tqdm's bookkeeping out of the write loop
+            write = file.write
+            bar_update = progress_bar.update
+            pending = 0
+
+            # Read straight from the raw stream into one reusable buffer instead
+            # of allocating a new bytes object per chunk through iter_content
+            raw = response.raw
+            raw.decode_content = True
+            buf = bytearray(chunk_size)
+            view = memoryview(buf)
+            try:
+                while True:
+                    n = raw.readinto(buf)
+                    if not n:
+                        break
+                    # a raw file may accept fewer bytes than offered
+                    written = write(view[:n])
+                    while written < n:
+                        written += write(view[written:n])
+                    pending += n
+                    if pending >= _PROGRESS_STEP:
+                        bar_update(pending)
+                        pending = 0
+            except (Urllib3HTTPError, OSError) as e:
+                print(f"Attempt {attempt}/{retries} interrupted : {e}")
+                continue
+            finally:
+                if pending:
+                    bar_update(pending)
+                response.close()
+
+        return os.stat(filename).st_size
+
+    return None
+
+
+def _load_range_state(state_filename, filename, total_size):
+    """
+    Per-range progress saved by an interrupted download_ranges, as a list of
+    [next offset, end] pairs, or None if there is nothing usable to resume.
+    """
+    try:
+        with open(state_filename, 'r') as f:
+            state = json.load(f)
+        if state['total'] != total_size or os.path.getsize(filename) != total_size:
+            return None
+        return [[int(offset), int(end)] for offset, end in state['ranges']]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
 
-    # For Downloading partial content i.e 206 is partial content
+def _save_range_state(state_filename, total_size, ranges):
+    tmp = state_filename + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump({'total': total_size, 'ranges': ranges}, f)
+    os.replace(tmp, state_filename)
 
-    elif response.status_code == 206:
-        # Save the content to a file
-        with open(filename, "ab") as file,tqdm.tqdm(
-            desc=f'Downloading ep {ep}',
+
+def download_ranges(session, posturl, params, headers, cookies, filename, total_size,
+                    ep=None, chunk_size=10 * 1024, workers=_RANGE_WORKERS, retries=3):
+    """
+    Fetch the file as `workers` byte ranges over parallel connections, each
+    worker writing at its own offset of a preallocated file with os.pwrite.
+
+    How far each range got is kept in a `<filename>.json` sidecar, so an
+    interrupted download picks up where every range stopped.
+
+    Returns the size of the file once complete, None if some range ran out
+    of retries (the download can be resumed), or False if the server would
+    not serve a range (for example answering with a full 200 response).
+    """
+    state_filename = filename + ".json"
+    ranges = _load_range_state(state_filename, filename, total_size)
+
+    if ranges is None:
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.posix_fallocate(fd, 0, total_size)
+        except (AttributeError, OSError):
+            # no posix_fallocate here, or the filesystem does not support it
+            os.ftruncate(fd, total_size)
+
+        step = -(-total_size // workers)
+        ranges = [[start, min(start + step, total_size) - 1] for start in range(0, total_size, step)]
+    else:
+        fd = os.open(filename, os.O_RDWR)
+
+    try:
+        state_lock = threading.Lock()
+        last_save = [time.monotonic()]
+        cancel = threading.Event()
+
+        def save_state(force=False):
+            # callers hold state_lock
+            if force or time.monotonic() - last_save[0] >= 1:
+                _save_range_state(state_filename, total_size, ranges)
+                last_save[0] = time.monotonic()
+
+        with state_lock:
+            save_state(force=True)
+
+        with tqdm.tqdm(
+            desc=f'Downloading Episode {ep}',
             total=total_size,
+            # the ranges cover the whole file, so whatever they still lack is all that is missing
+            initial=total_size - sum(end - offset + 1 for offset, end in ranges if offset <= end),
             unit='B',
             unit_scale=True,
             unit_divisor=1024,
             ncols=80
         ) as progress_bar:
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                file.write(chunk)
-                progress_bar.update(len(chunk))
 
-    else:
+            def fetch_range(index):
+                byte_range = ranges[index]
+                offset, end = byte_range
+                buf = bytearray(chunk_size)
+                view = memoryview(buf)
 
-        print("Failed to download the MP4 file.\n")
-        print(f"return code : {response.status_code}")
-        
\ No newline at end of file
+                for attempt in range(1, retries + 1):
+                    if offset > end:
+                        return True
+                    if cancel.is_set():
+                        return None
+
+                    pending = 0
+                    try:
+                        response = session.post(posturl, data=params, cookies=cookies, stream=True, timeout=30,
+                                                headers={**headers, "Range": f"bytes={offset}-{end}"})
+                        if response.status_code != 206:
+                            response.close()
+                            return False
+
+                        raw = response.raw
+                        raw.decode_content = True
+                        try:
+                            while offset <= end and not cancel.is_set():
+                                n = raw.readinto(buf)
+                                if not n:
+                                    break
+                                n = min(n, end - offset + 1)
+                                # pwrite may write fewer bytes than offered
+                                written = os.pwrite(fd, view[:n], offset)
+                                while written < n:
+                                    written += os.pwrite(fd, view[written:n], offset + written)
+                                offset += n
+                                pending += n
+                                if pending >= _PROGRESS_STEP:
+                                    with state_lock:
+                                        byte_range[0] = offset
+                                        progress_bar.update(pending)
+                                        save_state()
+                                    pending = 0
+                        finally:
+                            response.close()
+                    except (requests.RequestException, Urllib3HTTPError, OSError):
+                        pass
+                    finally:
+                        with state_lock:
+                            byte_range[0] = offset
+                            if pending:
+                                progress_bar.update(pending)
+
+                return True if offset > end else None
+
+            pool = ThreadPoolExecutor(max_workers=len(ranges))
+            futures = [pool.submit(fetch_range, index) for index in range(len(ranges))]
+            try:
+                results = [future.result() for future in futures]
+            except KeyboardInterrupt:
+                # stop the workers at their next chunk, then keep what they wrote
+                cancel.set()
+                pool.shutdown(wait=True, cancel_futures=True)
+                with state_lock:
+                    save_state(force=True)
+                raise
+            pool.shutdown()
+    finally:
+        os.close(fd)
+
+    if False in results:
+        return False
+
+    if all(results):
+        os.remove(state_filename)
+        return total_size
+
+    with state_lock:
+        save_state(force=True)
+    return None
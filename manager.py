@@ -1,43 +1,116 @@
 import json
 import os
 
-cwd = os.path.dirname(os.path.abspath(__file__))
+from jsonio import JSON_DATA_DIR, dumps, file_version, loads
 
-if not os.path.exists("json_data"):
-    os.mkdir(os.path.join(cwd, "json_data"))
+DATABASE_FILE = os.path.join(JSON_DATA_DIR, "animerecord.json")
 
-DATABASE_FILE = os.path.join(cwd, "json_data/animerecord.json")
+# Parsed database and its title -> index lookup, reused until the file changes. The
+# file is identified by (mtime, inode, size): saves replace it, so the inode changes
+# even when a coarse mtime does not. The lowercased search keys are built on the
+# first search after each load or save.
+_db_cache = {"version": None, "data": None, "title_index": None, "title_lc": None, "keyword_lc": None,
+             "search_blob": None}
 
 
-def ensure_file_exists():
-    """
-    Ensure the database file exists. If not, create an empty JSON file.
-    """
-    if not os.path.isfile(DATABASE_FILE):
-        with open(DATABASE_FILE, 'w') as f:
-            json.dump({}, f)
-
 def load_database():
     """
-    Load the database from the JSON file.
+    Load the database from the JSON file, reusing the parsed copy while the file is unchanged.
     """
-    ensure_file_exists()  # Ensure the file exists before loading
-    with open(DATABASE_FILE, 'r') as f:
-        return json.load(f)
+    try:
+        version = file_version(DATABASE_FILE)
+    except FileNotFoundError:
+        # First run, start with an empty database
+        data = {}
+        save_database(data)
+        return data
+
+    if _db_cache["version"] == version:
+        return _db_cache["data"]
+
+    with open(DATABASE_FILE, 'rb') as f:
+        raw = f.read()
+    data = loads(raw)
+
+    _db_cache["version"] = version
+    _db_cache["data"] = data
+    _db_cache["title_index"] = {v["title"]: k for k, v in data.items()}
+    _db_cache["title_lc"] = _db_cache["keyword_lc"] = _db_cache["search_blob"] = None
+    return data
 
 def save_database(data):
     """
     Save the provided data to the JSON database file.
     """
-    with open(DATABASE_FILE, 'w') as f:
-        json.dump(data, f, indent=4)  # Pretty-print the JSON with an indent of 4 spaces
+    # Serialise up front so the file gets a single write
+    payload = dumps(data)
+
+    # Write beside the database and swap it in, so a crash never leaves a half-written file
+    tmp = DATABASE_FILE + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, DATABASE_FILE)
+
+    # What we just wrote is what the next load would parse
+    if data is not _db_cache["data"]:
+        _db_cache["title_index"] = {v["title"]: k for k, v in data.items()}
+    _db_cache["version"] = file_version(DATABASE_FILE)
+    _db_cache["data"] = data
+    _db_cache["title_lc"] = _db_cache["keyword_lc"] = _db_cache["search_blob"] = None
+
+def invalidate_cache():
+    """
+    Drop the cached database, e.g. after the file was edited outside this module.
+    """
+    _db_cache["version"] = None
+    _db_cache["data"] = None
+    _db_cache["title_index"] = None
+    _db_cache["title_lc"] = _db_cache["keyword_lc"] = _db_cache["search_blob"] = None
+
+def _title_index(database):
+    """
+    Title -> index lookup for database, shared with the cache when it is the cached dict.
+    """
+    if database is _db_cache["data"]:
+        return _db_cache["title_index"]
+    return {v["title"]: k for k, v in database.items()}
 
 def get_next_index(database):
     """
     Get the next available index for a new record.
     """
     # Find the maximum index from existing keys or default to 0 if the database is empty
-    return max([int(key) for key in database.keys()] or [0]) + 1
+    return max((int(key) for key in database), default=0) + 1
+
+def _latest_episode(episodes):
+    """
+    Highest episode in an episode number or a selection string like "1,3,6-11".
+    """
+    if isinstance(episodes, int):
+        return episodes
+    return max(int(part.split('-')[-1]) for part in episodes.split(','))
+
+def _update_from_episode(record, about, current_episode):
+    # [keyword, info, episode]
+    return about, max(current_episode, record[2])
+
+def _update_from_text(record, about, current_episode):
+    # [keyword, info, episodes or about]
+    if ',' in record[2] and len(record[2]) < 30:
+        return about, max(current_episode, _latest_episode(record[2]))
+    return record[2], current_episode
+
+def _update_from_full(record, about, current_episode):
+    # [keyword, info, about, episodes]
+    return record[2], max(current_episode, _latest_episode(record[3]))
+
+_UPDATE_HANDLERS = {
+    (3, True): _update_from_episode,
+    (3, False): _update_from_text,
+    (4, False): _update_from_full,
+}
 
 def update_entry(record, database=None):
     """
@@ -46,15 +119,26 @@ def update_entry(record, database=None):
 
     if database is None:
         database = load_database()  # Load the current database only if not passed as an argument
-    
+
+    try:
+        _update_entry_inplace(record, database)
+        save_database(database)  # Save the updated database
+    except Exception:
+        invalidate_cache()  # Don't let a later load see changes that were never written
+        raise
+
+def _update_entry_inplace(record, database):
+    """
+    Update an existing record in the in-memory database without saving it.
+    """
     title = record[1].get('title')
     
     # Find the index of the existing record by matching the title
-    existing_index = next((index for index, data in database.items() if data["title"] == title), None)
+    existing_index = _title_index(database).get(title)
     
     if existing_index is None:
         print(f"No existing record found for title '{title}'. Adding as new record.")
-        add_new_record(record, database)  # If no existing record, add it as a new record
+        _add_new_record_inplace(record, database)  # If no existing record, add it as a new record
         return
     
     # Extract record details
@@ -64,33 +148,16 @@ def update_entry(record, database=None):
     year = record[1].get('year')
     cover = record[1].get('poster')
     
-    changes = []
-    for k,v in database.items():
-        if database[k]['title'] == title :
-            changes.append(database[k]['about'])
-            changes.append(database[k]['current_episode'])
-    
-    about = changes[0]
-    current_episode = changes[1]
+    about = database[existing_index]['about']
+    current_episode = database[existing_index]['current_episode']
 
     if isinstance(current_episode, str):
         current_episode = 0
 
-    if len(record) == 3:
-        if type(record[2]) == int:
-            current_episode = record[2] if current_episode < record[2] else current_episode
-        else:
-            if ',' in record[2] and len(record[2]) < 30:
-                latest_episode = max(list(int(s) for s in record[2].split(',')))
-                current_episode = latest_episode if current_episode < latest_episode else current_episode
-            else:
-                about = record[2]
-
-    elif len(record) == 4:
-        about = record[2]
-        current_episode_info = record[3]
-        latest_episode = max(list(int(s) for s in current_episode_info.split(',')))
-        current_episode = latest_episode if current_episode < latest_episode else current_episode
+    # Pick the handler for this record's shape: (length, whether the third item is an episode number)
+    handler = _UPDATE_HANDLERS.get((len(record), len(record) > 2 and isinstance(record[2], int)))
+    if handler:
+        about, current_episode = handler(record, about, current_episode)
 
     # Determine the status based on the current episode
     status = "Not Started Watching"
@@ -117,12 +184,22 @@ def update_entry(record, database=None):
         "year_aired": year,
         "about": about
     }
-    save_database(database)  # Save the updated database
 
 def add_new_record(record, database):
     """
     Add a new record to the database.
     """
+    try:
+        _add_new_record_inplace(record, database)
+        save_database(database)
+    except Exception:
+        invalidate_cache()  # Don't let a later load see changes that were never written
+        raise
+
+def _add_new_record_inplace(record, database):
+    """
+    Add a new record to the in-memory database without saving it.
+    """
     next_index = get_next_index(database)
     
     # Extract record details
@@ -143,8 +220,7 @@ def add_new_record(record, database):
             about = record[2]
     elif len(record) == 4:
         about = record[2]
-        current_episode_info = record[3]
-        current_episode = int(max(list(record[3])))
+        current_episode = _latest_episode(record[3])
 
     status = "Not Started Watching"
     if current_episode > 0:
@@ -153,6 +229,9 @@ def add_new_record(record, database):
         else:
             status = "Completed"
 
+    # JSON object keys are strings, keep the in-memory copy the same shape
+    next_index = str(next_index)
+    _title_index(database)[title] = next_index
     database[next_index] = {
         "title": title,
         "keyword": keyword,
@@ -165,41 +244,74 @@ def add_new_record(record, database):
         "year_aired": year,
         "about": about
     }
-    save_database(database)
 
 def process_record(record, update=False):
     """
     Process and add a new record to the database. If the record exists, update it if `update` is True.
     """
+    process_records([record], update)
+
+def process_records(records, update=False):
+    """
+    Process many records with a single database load and a single save.
+    """
     database = load_database()
-    
+    changed = False
+    try:
+        for record in records:
+            changed = _process_record_inplace(record, database, update) or changed
+        if changed:
+            save_database(database)
+    except Exception:
+        # The records are applied to the cached dict itself, so drop it
+        # rather than let a later load see changes that were never written
+        invalidate_cache()
+        raise
+
+def _process_record_inplace(record, database, update):
+    """
+    Add or update one record in the in-memory database. Returns True if it changed anything.
+    """
     title = record[1].get('title')
     
     # Check if the record already exists in the database by title
-    existing_index = next((index for index, data in database.items() if data["title"] == title), None)
+    existing_index = _title_index(database).get(title)
     
     if existing_index is not None:
         if update:
             print(f"Record with title '{title}' already exists. Updating it.")
-            update_entry(record, database)
-        else:
-            print(f"Record with title '{title}' already exists. No action taken.")
-    else:
-        print(f"Adding new record with title '{title}'.")
-        add_new_record(record, database)
+            _update_entry_inplace(record, database)
+            return True
+        print(f"Record with title '{title}' already exists. No action taken.")
+        return False
+
+    print(f"Adding new record with title '{title}'.")
+    _add_new_record_inplace(record, database)
+    return True
 
 def search_record(query):
     """
     Search for records in the database that match the query.
     """
     database = load_database()
-    
+    lower_query = query.lower()
+
+    # Lowercase every title and keyword once per database version, not once per search
+    if _db_cache["title_lc"] is None:
+        _db_cache["title_lc"] = {k: v["title"].lower() for k, v in database.items()}
+        _db_cache["keyword_lc"] = {k: v["keyword"].lower() for k, v in database.items()}
+        # Every key in one string, so a query matching nothing costs a single substring test
+        _db_cache["search_blob"] = "\x01".join((*_db_cache["title_lc"].values(), *_db_cache["keyword_lc"].values()))
+    if lower_query not in _db_cache["search_blob"]:
+        return {}
+    title_lc = _db_cache["title_lc"]
+    keyword_lc = _db_cache["keyword_lc"]
+
     results = {}
     
-    for key, value in database.items():
-        lower_query = query.lower()
-        if lower_query in value["title"].lower() or lower_query in value["keyword"].lower():
-            results[key] = value
+    for key in database:
+        if lower_query in title_lc[key] or lower_query in keyword_lc[key]:
+            results[key] = database[key]
     
     return results
 